@@ -7,31 +7,76 @@ import os
 import csv
 import json
 from pathlib import Path
+from typing import Dict
+import numpy as np
 from extract_exif import process_photo_batch
-
-
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two GPS coordinates in meters."""
-    from math import radians, cos, sin, asin, sqrt
-    R = 6371000  # Earth radius in meters
-    phi1, phi2 = radians(lat1), radians(lat2)
-    dphi = radians(lat2 - lat1)
-    dlambda = radians(lon2 - lon1)
-
-    a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
-    c = 2 * asin(sqrt(a))
-
-    return R * c
+from match_photos import nearest_route_points
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CACHE_DIR = Path(__file__).parent / '.cache'
+
+
+def _load_ride_coords(rides_json: Path) -> Dict[str, np.ndarray]:
+    """
+    Load route coordinates and ride metadata from rides.json.
+
+    Results are cached as an .npz file, rebuilt whenever rides.json is newer.
+    Ride i owns lat[offsets[i]:offsets[i + 1]] (radians, points without GPS
+    dropped); name/date/start/end hold the per-ride metadata.
+    """
+    CACHE_DIR.mkdir(exist_ok=True)
+    cache_path = CACHE_DIR / 'rides.cache.npz'
+    if cache_path.exists() and cache_path.stat().st_mtime >= rides_json.stat().st_mtime:
+        with np.load(cache_path) as cache:
+            return {key: cache[key] for key in cache.files}
+
+    with open(rides_json, 'rb') as f:
+        rides = (orjson.loads(f.read()) if orjson else json.load(f))['rides']
+
+    lats, lons, offsets = [], [], [0]
+    for ride in rides:
+        for p in ride.get('route') or []:
+            if p.get('lat') and p.get('lon'):
+                lats.append(p['lat'])
+                lons.append(p['lon'])
+        offsets.append(len(lats))
+
+    coords = {
+        'lat': np.radians(np.array(lats, dtype=np.float64)),
+        'lon': np.radians(np.array(lons, dtype=np.float64)),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'name': np.array([ride['name'] for ride in rides], dtype=str),
+        'date': np.array([ride['date'] for ride in rides], dtype=str),
+        'start': np.array([ride['route'][0]['time'] if ride.get('route') else '' for ride in rides], dtype=str),
+        'end': np.array([ride['route'][-1]['time'] if ride.get('route') else '' for ride in rides], dtype=str),
+    }
+    np.savez(cache_path, **coords)
+
+    return coords
 
 
 def assign_photos_to_rides():
-    """Load rides and photos, assign each photo to a ride via GPS snapping."""
+    """
+    Load rides and photos, assign each photo to a ride via GPS snapping.
 
-    # Load rides data
+    Returns:
+        Dict of photo counts per assigned ride (or NO_GPS / NO_MATCH / TOO_FAR)
+    """
+
+    # Load ride route coordinates and metadata (cached as arrays)
     rides_json = Path(__file__).parent.parent / 'public' / 'data' / 'rides.json'
-    with open(rides_json, 'r') as f:
-        data = json.load(f)
-        rides = data['rides']
+    coords = _load_ride_coords(rides_json)
+    rides = [
+        {'name': name, 'date': date, 'start': start, 'end': end}
+        for name, date, start, end in zip(
+            coords['name'].tolist(), coords['date'].tolist(),
+            coords['start'].tolist(), coords['end'].tolist()
+        )
+    ]
 
     print(f"Loaded {len(rides)} rides")
 
@@ -41,12 +86,63 @@ def assign_photos_to_rides():
 
     print(f"Found {len(photos)} photos")
 
-    # Assign each photo to a ride based on GPS location
-    assignments = []
+    # Ride owning each route point
+    owner_ride_idx = np.repeat(np.arange(len(rides)), np.diff(coords['offsets']))
+
+    # Partition photos once: only GPS-tagged photos go through the spatial search
+    gps_photos = [photo for photo in photos if photo.get('location')]
+    no_gps_photos = [photo for photo in photos if not photo.get('location')]
+
+    # Find the closest route point for all photos with GPS in one batched query
+    locations = [photo['location'] for photo in gps_photos]
+    n = len(locations)
+    photo_lat = np.radians(np.fromiter((loc['lat'] for loc in locations), dtype=np.float64, count=n))
+    photo_lon = np.radians(np.fromiter((loc['lon'] for loc in locations), dtype=np.float64, count=n))
+    idx, best_distances = nearest_route_points(coords['lat'], coords['lon'], photo_lat, photo_lon)
+    best_ride_idx = owner_ride_idx[idx] if owner_ride_idx.size else np.full(n, -1)
 
-    for photo in photos:
-        if not photo.get('location'):
-            assignments.append({
+    # Assign each photo to a ride based on GPS location. Rows are generated
+    # while the CSV is written, counting photos per assigned ride on the way.
+    ride_counts = {}
+
+    def generate_rows():
+        rows = zip(gps_photos, locations, best_ride_idx.tolist(), best_distances.tolist())
+        for photo, location, ride_idx, best_distance in rows:
+            # The ride owning the closest route point to this photo
+            best_ride = rides[ride_idx] if ride_idx >= 0 else None
+
+            # Record assignment
+            if best_ride and best_distance < 1000:  # 1km threshold
+                row = {
+                    'filename': photo['filename'],
+                    'timestamp': photo.get('timestamp', ''),
+                    'latitude': location['lat'],
+                    'longitude': location['lon'],
+                    'assigned_ride': best_ride['name'],
+                    'ride_date': best_ride['date'],
+                    'ride_start': best_ride['start'],
+                    'ride_end': best_ride['end'],
+                    'distance_meters': round(best_distance, 1)
+                }
+            else:
+                row = {
+                    'filename': photo['filename'],
+                    'timestamp': photo.get('timestamp', ''),
+                    'latitude': location['lat'],
+                    'longitude': location['lon'],
+                    'assigned_ride': 'NO_MATCH' if best_ride is None else 'TOO_FAR',
+                    'ride_date': '',
+                    'ride_start': '',
+                    'ride_end': '',
+                    'distance_meters': round(best_distance, 1) if best_distance != float('inf') else None
+                }
+
+            ride_counts[row['assigned_ride']] = ride_counts.get(row['assigned_ride'], 0) + 1
+            yield row
+
+        for photo in no_gps_photos:
+            ride_counts['NO_GPS'] = ride_counts.get('NO_GPS', 0) + 1
+            yield {
                 'filename': photo['filename'],
                 'timestamp': photo.get('timestamp', ''),
                 'latitude': None,
@@ -56,59 +152,7 @@ def assign_photos_to_rides():
                 'ride_start': '',
                 'ride_end': '',
                 'distance_meters': None
-            })
-            continue
-
-        # Find the ride with the closest route point to this photo
-        best_ride = None
-        best_distance = float('inf')
-
-        for ride in rides:
-            if not ride.get('route') or len(ride['route']) == 0:
-                continue
-
-            # Find closest point in this ride's route
-            for point in ride['route']:
-                if not point.get('lat') or not point.get('lon'):
-                    continue
-
-                distance = haversine_distance(
-                    photo['location']['lat'], photo['location']['lon'],
-                    point['lat'], point['lon']
-                )
-
-                if distance < best_distance:
-                    best_distance = distance
-                    best_ride = ride
-
-        # Record assignment
-        if best_ride and best_distance < 1000:  # 1km threshold
-            ride_start_str = best_ride['route'][0]['time']
-            ride_end_str = best_ride['route'][-1]['time']
-
-            assignments.append({
-                'filename': photo['filename'],
-                'timestamp': photo.get('timestamp', ''),
-                'latitude': photo['location']['lat'],
-                'longitude': photo['location']['lon'],
-                'assigned_ride': best_ride['name'],
-                'ride_date': best_ride['date'],
-                'ride_start': ride_start_str,
-                'ride_end': ride_end_str,
-                'distance_meters': round(best_distance, 1)
-            })
-        else:
-            assignments.append({
-                'filename': photo['filename'],
-                'timestamp': photo.get('timestamp', ''),
-                'latitude': photo['location']['lat'],
-                'longitude': photo['location']['lon'],
-                'assigned_ride': 'NO_MATCH' if best_ride is None else 'TOO_FAR',
-                'ride_date': '',
-                'ride_start': '',
-                'ride_end': '',
-                'distance_meters': round(best_distance, 1) if best_distance != float('inf') else None
-            })
+            }
 
     # Write to CSV
     output_csv = Path(__file__).parent.parent / 'photo_ride_assignments.csv'
@@ -119,28 +163,24 @@ def assign_photos_to_rides():
         ]
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        writer.writerows(assignments)
+        writer.writerows(generate_rows())
 
     print(f"\nWrote photo-to-ride assignments to {output_csv}")
 
     # Print summary
-    matched_count = sum(1 for a in assignments if a['assigned_ride'] not in ['NO_GPS', 'NO_MATCH', 'TOO_FAR'])
+    total_count = sum(ride_counts.values())
+    matched_count = total_count - sum(ride_counts.get(k, 0) for k in ['NO_GPS', 'NO_MATCH', 'TOO_FAR'])
     print(f"\nSummary:")
-    print(f"  Total photos: {len(assignments)}")
+    print(f"  Total photos: {total_count}")
     print(f"  Matched to rides: {matched_count}")
-    print(f"  Unmatched: {len(assignments) - matched_count}")
+    print(f"  Unmatched: {total_count - matched_count}")
 
     # Breakdown by ride
     print("\nPhotos per ride:")
-    ride_counts = {}
-    for a in assignments:
-        ride_name = a['assigned_ride']
-        ride_counts[ride_name] = ride_counts.get(ride_name, 0) + 1
-
     for ride_name in sorted(ride_counts.keys()):
         print(f"  {ride_name}: {ride_counts[ride_name]}")
 
-    return assignments
+    return ride_counts
 
 
 if __name__ == '__main__':
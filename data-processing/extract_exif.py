@@ -2,12 +2,28 @@
 Extract EXIF metadata from photos.
 """
 import os
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 import exifread
 
+try:
+    import exiftool
+except ImportError:
+    exiftool = None
+
+# Tags requested from exiftool (values are returned numerically because of -n)
+EXIFTOOL_TAGS = [
+    'EXIF:DateTimeOriginal', 'EXIF:ModifyDate',
+    'EXIF:GPSLatitude', 'EXIF:GPSLatitudeRef',
+    'EXIF:GPSLongitude', 'EXIF:GPSLongitudeRef',
+    'ExifTool:Error',
+]
+
+PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.heic'}
+
 
 def convert_to_degrees(value):
     """Convert GPS coordinates to degrees in float format."""
@@ -17,6 +33,15 @@ def convert_to_degrees(value):
     return d + (m / 60.0) + (s / 3600.0)
 
 
+def parse_exif_timestamp(value: str) -> Optional[str]:
+    """Convert an EXIF 'YYYY:MM:DD HH:MM:SS' timestamp to ISO format (assumes UTC)."""
+    try:
+        dt = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    return dt.replace(tzinfo=timezone.utc).isoformat()
+
+
 def extract_photo_metadata(image_path: str) -> Optional[Dict]:
     """
     Extract metadata from a single photo.
@@ -37,14 +62,7 @@ def extract_photo_metadata(image_path: str) -> Optional[Dict]:
         # Extract timestamp
         datetime_tag = tags.get('EXIF DateTimeOriginal') or tags.get('Image DateTime')
         if datetime_tag:
-            try:
-                from datetime import timezone
-                dt = datetime.strptime(str(datetime_tag), '%Y:%m:%d %H:%M:%S')
-                # Assume UTC timezone
-                dt = dt.replace(tzinfo=timezone.utc)
-                metadata['timestamp'] = dt.isoformat()
-            except ValueError:
-                pass
+            metadata['timestamp'] = parse_exif_timestamp(str(datetime_tag))
 
         # Extract GPS coordinates
         gps_latitude = tags.get('GPS GPSLatitude')
@@ -76,24 +94,108 @@ def extract_photo_metadata(image_path: str) -> Optional[Dict]:
         return None
 
 
-def process_photo_batch(directory: str) -> List[Dict]:
+def bulk_extract_exif(paths: List[str]) -> Optional[List[Dict]]:
     """
-    Process all photos in a directory.
+    Extract metadata from many photos with a single long-lived exiftool process.
 
     Returns:
-        List of photo metadata dicts
+        List of photo metadata dicts, or None if exiftool is not available
     """
+    if exiftool is None:
+        return None
+
+    try:
+        with exiftool.ExifToolHelper(check_execute=False) as et:
+            results = et.get_tags(paths, tags=EXIFTOOL_TAGS)
+    except Exception as e:
+        print(f"exiftool not available ({e}); reading EXIF with exifread instead")
+        return None
+
     photos = []
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.heic'}
+    for tags in results:
+        # Files exiftool could not read are dropped, as extract_photo_metadata
+        # returns None for them
+        if 'ExifTool:Error' in tags:
+            print(f"Error reading {tags['SourceFile']}: {tags['ExifTool:Error']}")
+            continue
+
+        metadata = {
+            'filename': os.path.basename(tags['SourceFile']),
+            'timestamp': None,
+            'location': None
+        }
+
+        datetime_tag = tags.get('EXIF:DateTimeOriginal') or tags.get('EXIF:ModifyDate')
+        if datetime_tag:
+            metadata['timestamp'] = parse_exif_timestamp(str(datetime_tag))
+
+        lat = tags.get('EXIF:GPSLatitude')
+        lat_ref = tags.get('EXIF:GPSLatitudeRef')
+        lon = tags.get('EXIF:GPSLongitude')
+        lon_ref = tags.get('EXIF:GPSLongitudeRef')
+
+        if all(v is not None for v in (lat, lat_ref, lon, lon_ref)):
+            try:
+                lat = -float(lat) if lat_ref == 'S' else float(lat)
+                lon = -float(lon) if lon_ref == 'W' else float(lon)
+
+                metadata['location'] = {
+                    'lat': round(lat, 6),
+                    'lon': round(lon, 6)
+                }
+            except (TypeError, ValueError) as e:
+                print(f"Error extracting GPS from {tags['SourceFile']}: {e}")
+
+        photos.append(metadata)
+
+    return photos
+
+
+def list_photo_paths(directory: str) -> List[str]:
+    """
+    List the image files directly inside a directory.
+
+    Returns:
+        List of full paths with a known image extension
+    """
+    # DirEntry caches file type info, so is_file() needs no extra stat call
+    with os.scandir(directory) as entries:
+        return [
+            entry.path for entry in entries
+            if os.path.splitext(entry.name)[1].lower() in PHOTO_EXTENSIONS and entry.is_file()
+        ]
+
+
+def extract_photos(paths: List[str]) -> List[Dict]:
+    """
+    Extract metadata from a list of photos, which may span several directories.
+
+    Uses one exiftool process for every path when available,
+    otherwise reads the files with exifread in a process pool.
+
+    Returns:
+        List of photo metadata dicts, in the order of paths
+    """
+    if not paths:
+        return []
+
+    photos = bulk_extract_exif(paths)
+    if photos is None:
+        # Parse files across all cores; EXIF parsing is partly CPU-bound
+        with ProcessPoolExecutor() as executor:
+            photos = [m for m in executor.map(extract_photo_metadata, paths, chunksize=16) if m]
+
+    return photos
 
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        ext = os.path.splitext(filename)[1].lower()
 
-        if os.path.isfile(filepath) and ext in valid_extensions:
-            metadata = extract_photo_metadata(filepath)
-            if metadata:
-                photos.append(metadata)
+def process_photo_batch(directory: str) -> List[Dict]:
+    """
+    Process all photos in a directory.
+
+    Returns:
+        List of photo metadata dicts, sorted by timestamp
+    """
+    photos = extract_photos(list_photo_paths(directory))
 
     # Sort by timestamp
     photos.sort(key=lambda x: x['timestamp'] if x['timestamp'] else '')
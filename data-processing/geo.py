@@ -0,0 +1,17 @@
+"""
+Great-circle distance helpers shared by the data processing scripts.
+"""
+import numpy as np
+
+
+def haversine_vector(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Calculate element-wise distances between arrays of GPS coordinates in meters."""
+    R = 6371000  # Earth radius in meters
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lon2 - lon1)
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(a))
+
+    return R * c
@@ -3,20 +3,72 @@ Match photos to ride routes based on timestamp and GPS location.
 """
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
-from math import radians, cos, sin, asin, sqrt
+import numpy as np
+from scipy.spatial import cKDTree
 
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two GPS coordinates in meters."""
-    R = 6371000  # Earth radius in meters
-    phi1, phi2 = radians(lat1), radians(lat2)
-    dphi = radians(lat2 - lat1)
-    dlambda = radians(lon2 - lon1)
+def latlon_to_ecef(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Convert coordinates in radians to points on the unit sphere.
+
+    Returns:
+        (N, 3) array of x, y, z coordinates
+    """
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_meters(chord: np.ndarray) -> np.ndarray:
+    """Convert unit-sphere chord lengths to great-circle distances in meters."""
+    return 2 * 6371000 * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def nearest_route_points(lat: np.ndarray, lon: np.ndarray, photo_lat: np.ndarray, photo_lon: np.ndarray):
+    """
+    Find the nearest route point to each photo with a KD-tree, all coordinates in radians.
+
+    Points are indexed on the unit sphere: chord length grows monotonically with
+    great-circle distance, so the nearest point in 3-D is also the nearest point
+    along the Earth's surface.
+
+    Returns:
+        Tuple of (point index, distance in meters) arrays, one entry per photo;
+        distances are inf when there are no route points
+    """
+    if not lat.size or not photo_lat.size:
+        return np.zeros(len(photo_lat), dtype=np.intp), np.full(len(photo_lat), np.inf)
+
+    tree = cKDTree(latlon_to_ecef(lat, lon))
+    chord, idx = tree.query(latlon_to_ecef(photo_lat, photo_lon), k=1, workers=-1)
 
-    a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
-    c = 2 * asin(sqrt(a))
+    return idx, chord_to_meters(chord)
 
-    return R * c
+
+def prepare_route(route: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    Convert a route's GPS points to structure-of-arrays form in a single pass,
+    so it can be searched for many photos. Points without GPS are dropped.
+
+    Returns:
+        Dict of parallel arrays: index (position in the original route),
+        lat and lon (radians)
+    """
+    indices, lats, lons = [], [], []
+    for i, point in enumerate(route):
+        lat, lon = point.get('lat'), point.get('lon')
+        if lat and lon:
+            indices.append(i)
+            lats.append(lat)
+            lons.append(lon)
+
+    lat_rad = np.radians(np.array(lats, dtype=np.float64))
+    lon_rad = np.radians(np.array(lons, dtype=np.float64))
+
+    return {
+        'index': np.array(indices, dtype=np.intp),
+        'lat': lat_rad,
+        'lon': lon_rad,
+    }
 
 
 def find_nearest_route_point(photo: Dict, route: List[Dict]) -> int:
@@ -30,24 +82,14 @@ def find_nearest_route_point(photo: Dict, route: List[Dict]) -> int:
     if not photo.get('location'):
         return None
 
-    best_index = 0
-    best_distance = float('inf')
+    route_arrays = prepare_route(route)
+    if not route_arrays['index'].size:
+        return 0
 
-    for i, point in enumerate(route):
-        if not point.get('lat') or not point.get('lon'):
-            continue
-
-        # Calculate spatial distance only
-        spatial_distance = haversine_distance(
-            photo['location']['lat'], photo['location']['lon'],
-            point['lat'], point['lon']
-        )
-
-        if spatial_distance < best_distance:
-            best_distance = spatial_distance
-            best_index = i
-
-    return best_index
+    location = photo['location']
+    idx, _ = nearest_route_points(route_arrays['lat'], route_arrays['lon'],
+                                  np.radians([location['lat']]), np.radians([location['lon']]))
+    return int(route_arrays['index'][idx[0]])
 
 
 def interpolate_metrics(route: List[Dict], index: int, timestamp: str) -> Dict:
@@ -81,22 +123,28 @@ def match_photos_to_ride(ride_route: List[Dict], photos: List[Dict]) -> List[Dic
 
     matched_photos = []
 
-    for photo in photos:
-        # Only match photos that have GPS coordinates
-        if not photo.get('location'):
-            continue
-
-        route_index = find_nearest_route_point(photo, ride_route)
-
-        if route_index is not None:
-            stats = interpolate_metrics(ride_route, route_index, photo.get('timestamp', ''))
-
-            matched_photo = {
-                **photo,
-                'routeIndex': route_index,
-                'stats': stats
-            }
-            matched_photos.append(matched_photo)
+    # Only match photos that have GPS coordinates
+    gps_photos = [photo for photo in photos if photo.get('location')]
+    route_arrays = prepare_route(ride_route)
+    if not route_arrays['index'].size:
+        route_indices = [0] * len(gps_photos)
+    else:
+        coords = np.radians(np.array(
+            [(loc['lat'], loc['lon']) for loc in (photo['location'] for photo in gps_photos)],
+            dtype=np.float64
+        ).reshape(-1, 2))
+        idx, _ = nearest_route_points(route_arrays['lat'], route_arrays['lon'], coords[:, 0], coords[:, 1])
+        route_indices = route_arrays['index'][idx].tolist()
+
+    for photo, route_index in zip(gps_photos, route_indices):
+        stats = interpolate_metrics(ride_route, route_index, photo.get('timestamp', ''))
+
+        matched_photo = {
+            **photo,
+            'routeIndex': route_index,
+            'stats': stats
+        }
+        matched_photos.append(matched_photo)
 
     return matched_photos
 
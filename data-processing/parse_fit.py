@@ -4,23 +4,38 @@ Uses fitparse library to read Garmin FIT files.
 """
 import json
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Optional
-from math import radians, cos, sin, asin, sqrt
-import random
-import pytz
+from typing import List, Dict, Optional, Tuple
+from itertools import accumulate
+import numpy as np
+from geo import haversine_vector
 
+# FIT positions are stored as semicircles (2^31 semicircles = 180 degrees)
+_SEMI_TO_DEG = 180.0 / (1 << 31)
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two GPS coordinates in meters."""
-    R = 6371000  # Earth radius in meters
-    phi1, phi2 = radians(lat1), radians(lat2)
-    dphi = radians(lat2 - lat1)
-    dlambda = radians(lon2 - lon1)
 
-    a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
-    c = 2 * asin(sqrt(a))
+def _fit_timestamp(value) -> Optional[datetime]:
+    """Make a FIT timestamp timezone-aware (FIT timestamps are UTC)."""
+    if not value:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+# Values for fields a FIT record may not carry
+_POINT_DEFAULTS = {'hr': None, 'power': None, 'speed': 0, 'distance': 0, 'ele': 0, 'gradient': 0}
 
-    return R * c
+# Map FIT record field names to (point key, converted value)
+FIELD_HANDLERS = {
+    'position_lat': lambda v: ('lat', v * _SEMI_TO_DEG if v else None),
+    'position_long': lambda v: ('lon', v * _SEMI_TO_DEG if v else None),
+    'altitude': lambda v: ('ele', v),
+    'timestamp': lambda v: ('time', _fit_timestamp(v)),
+    'heart_rate': lambda v: ('hr', v),
+    'power': lambda v: ('power', v),
+    'speed': lambda v: ('speed', v * 3.6 if v else 0),  # m/s to km/h
+    'distance': lambda v: ('distance', v / 1000 if v else 0),  # m to km
+}
 
 
 def parse_fit_file(filepath: str) -> Dict:
@@ -37,55 +52,34 @@ def parse_fit_file(filepath: str) -> Dict:
         route_points = []
 
         for record in fitfile.get_messages('record'):
-            point_data = {}
+            point_data = _POINT_DEFAULTS.copy()
             for field in record:
-                if field.name == 'position_lat':
-                    point_data['lat'] = field.value * (180 / 2**31) if field.value else None
-                elif field.name == 'position_long':
-                    point_data['lon'] = field.value * (180 / 2**31) if field.value else None
-                elif field.name == 'altitude':
-                    point_data['ele'] = field.value
-                elif field.name == 'timestamp':
-                    if field.value:
-                        # Ensure timezone-aware datetime (FIT timestamps are UTC)
-                        dt = field.value
-                        if dt.tzinfo is None:
-                            dt = dt.replace(tzinfo=timezone.utc)
-                        point_data['time'] = dt.isoformat()
-                    else:
-                        point_data['time'] = None
-                elif field.name == 'heart_rate':
-                    point_data['hr'] = field.value
-                elif field.name == 'power':
-                    point_data['power'] = field.value
-                elif field.name == 'speed':
-                    point_data['speed'] = field.value * 3.6 if field.value else 0  # m/s to km/h
-                elif field.name == 'distance':
-                    point_data['distance'] = field.value / 1000 if field.value else 0  # m to km
+                handler = FIELD_HANDLERS.get(field.name)
+                if handler:
+                    key, value = handler(field.value)
+                    point_data[key] = value
 
             if point_data.get('lat') and point_data.get('lon'):
                 route_points.append(point_data)
 
-        # Calculate gradients and speeds if not provided
+        # Keep the raw datetimes for the summary; points store ISO strings
+        start_time = route_points[0].get('time') if route_points else None
+        end_time = route_points[-1].get('time') if route_points else None
+
+        # Calculate gradients (the first point keeps the default of 0)
         for i, point in enumerate(route_points):
-            if 'gradient' not in point and i > 0:
+            if point.get('time'):
+                point['time'] = point['time'].isoformat()
+
+            if i > 0:
                 prev = route_points[i-1]
-                ele_diff = point.get('ele', 0) - prev.get('ele', 0)
-                dist_diff = (point.get('distance', 0) - prev.get('distance', 0)) * 1000  # km to m
+                ele_diff = point['ele'] - prev['ele']
+                dist_diff = (point['distance'] - prev['distance']) * 1000  # km to m
                 point['gradient'] = (ele_diff / dist_diff * 100) if dist_diff > 0 else 0
-            else:
-                point['gradient'] = 0
-
-            # Ensure all required fields
-            point.setdefault('hr', None)
-            point.setdefault('power', None)
-            point.setdefault('speed', 0)
-            point.setdefault('distance', 0)
-            point.setdefault('ele', 0)
 
         return {
             'route': route_points,
-            'summary': calculate_summary(route_points)
+            'summary': calculate_summary(route_points, start_time, end_time)
         }
 
     except Exception as e:
@@ -93,36 +87,71 @@ def parse_fit_file(filepath: str) -> Dict:
         return None
 
 
-def calculate_summary(route_points: List[Dict]) -> Dict:
-    """Calculate summary statistics from route points."""
+def route_stats(route_points: List[Dict]) -> Tuple:
+    """
+    Accumulate route statistics in a single pass over the points.
+
+    Returns:
+        Tuple of (elevation gain, avg speed, avg hr, avg power, max elevation)
+    """
+    speed_sum, speed_n = 0, 0
+    hr_sum, hr_n = 0, 0
+    power_sum, power_n = 0, 0
+    elevation_gain = 0
+    prev_ele = route_points[0].get('ele', 0)
+    max_elevation = prev_ele
+
+    for p in route_points:
+        speed = p.get('speed', 0)
+        if speed > 0:
+            speed_sum += speed
+            speed_n += 1
+
+        hr = p.get('hr')
+        if hr:
+            hr_sum += hr
+            hr_n += 1
+
+        power = p.get('power')
+        if power:
+            power_sum += power
+            power_n += 1
+
+        ele = p.get('ele', 0)
+        if ele > prev_ele:
+            elevation_gain += ele - prev_ele
+        if ele > max_elevation:
+            max_elevation = ele
+        prev_ele = ele
+
+    avg_speed = speed_sum / speed_n if speed_n else 0
+    avg_hr = hr_sum / hr_n if hr_n else None
+    avg_power = power_sum / power_n if power_n else None
+
+    return elevation_gain, avg_speed, avg_hr, avg_power, max_elevation
+
+
+def calculate_summary(route_points: List[Dict], start_time: Optional[datetime] = None,
+                      end_time: Optional[datetime] = None) -> Dict:
+    """
+    Calculate summary statistics from route points.
+
+    start_time / end_time may be passed in when the route's datetimes are
+    already known; otherwise they are parsed from the first and last points.
+    """
     if not route_points:
         return {}
 
     total_distance = route_points[-1].get('distance', 0)
 
-    # Calculate elevation gain
-    elevation_gain = 0
-    for i in range(1, len(route_points)):
-        ele_diff = route_points[i].get('ele', 0) - route_points[i-1].get('ele', 0)
-        if ele_diff > 0:
-            elevation_gain += ele_diff
-
     # Calculate duration
-    start_time = datetime.fromisoformat(route_points[0]['time'].replace('Z', '+00:00'))
-    end_time = datetime.fromisoformat(route_points[-1]['time'].replace('Z', '+00:00'))
+    if start_time is None:
+        start_time = datetime.fromisoformat(route_points[0]['time'].replace('Z', '+00:00'))
+    if end_time is None:
+        end_time = datetime.fromisoformat(route_points[-1]['time'].replace('Z', '+00:00'))
     duration = (end_time - start_time).total_seconds()
 
-    # Calculate averages
-    speeds = [p.get('speed', 0) for p in route_points if p.get('speed', 0) > 0]
-    avg_speed = sum(speeds) / len(speeds) if speeds else 0
-
-    hrs = [p.get('hr') for p in route_points if p.get('hr')]
-    avg_hr = sum(hrs) / len(hrs) if hrs else None
-
-    powers = [p.get('power') for p in route_points if p.get('power')]
-    avg_power = sum(powers) / len(powers) if powers else None
-
-    max_elevation = max([p.get('ele', 0) for p in route_points])
+    elevation_gain, avg_speed, avg_hr, avg_power, max_elevation = route_stats(route_points)
 
     return {
         'distance': total_distance,
@@ -141,6 +170,7 @@ def generate_mock_rides(num_rides: int = 6) -> List[Dict]:
     Creates realistic West Coast routes.
     """
     rides = []
+    rng = np.random.default_rng()
     base_date = datetime(2022, 5, 14, 8, 0, 0, tzinfo=timezone.utc)
 
     # West Coast locations (Victoria BC area based on the sample TCX)
@@ -157,74 +187,60 @@ def generate_mock_rides(num_rides: int = 6) -> List[Dict]:
         start_loc = start_locations[i]
         ride_date = base_date.replace(day=14 + i)
 
-        # Generate route points (simulate 2-4 hour ride)
-        route_points = []
-        num_points = random.randint(3600, 7200)  # 1 point per second
-        distance = 0
-        elevation = start_loc.get("elevation", 10)
-
-        for j in range(num_points):
-            # Simulate movement
-            lat = start_loc["lat"] + (j / num_points) * random.uniform(-0.3, 0.3)
-            lon = start_loc["lon"] + (j / num_points) * random.uniform(-0.3, 0.3)
-
-            # Calculate distance from previous point
-            if j > 0:
-                dist_delta = haversine_distance(
-                    route_points[-1]["lat"], route_points[-1]["lon"],
-                    lat, lon
-                ) / 1000  # convert to km
-                distance += dist_delta
-
-            # Simulate elevation changes (rolling hills)
-            if j > 0:
-                elevation += random.uniform(-2, 3)
-                elevation = max(0, min(elevation, 500))  # Clamp between 0-500m
-
-            # Simulate speed (10-35 km/h)
-            speed = random.uniform(15, 30)
-
-            # Simulate HR and power
-            hr = random.randint(120, 180) if random.random() > 0.1 else None
-            power = random.randint(150, 250) if random.random() > 0.3 else None
-
-            # Calculate gradient
-            if j > 0:
-                ele_diff = elevation - route_points[-1]["ele"]
-                dist_diff = dist_delta * 1000  # km to m
-                gradient = (ele_diff / dist_diff * 100) if dist_diff > 0 else 0
-            else:
-                gradient = 0
-
-            point = {
-                "lat": round(lat, 6),
-                "lon": round(lon, 6),
-                "ele": round(elevation, 1),
+        # Generate route points (simulate 2-4 hour ride), 1 point per second
+        num_points = int(rng.integers(3600, 7201))
+        progress = np.arange(num_points) / num_points
+
+        # Simulate movement
+        lats = np.round(start_loc["lat"] + progress * rng.uniform(-0.3, 0.3, num_points), 6)
+        lons = np.round(start_loc["lon"] + progress * rng.uniform(-0.3, 0.3, num_points), 6)
+
+        # Distance between consecutive points (km), accumulated along the route
+        dist_deltas = haversine_vector(lats[:-1], lons[:-1], lats[1:], lons[1:]) / 1000
+        distances = np.concatenate(([0.0], np.cumsum(dist_deltas)))
+        distance = float(distances[-1])
+
+        # Simulate elevation changes (rolling hills), clamped between 0-500m at every step
+        steps = rng.uniform(-2, 3, num_points - 1)
+        elevations = np.fromiter(
+            accumulate(steps, lambda ele, step: max(0, min(ele + step, 500)),
+                       initial=start_loc.get("elevation", 10)),
+            dtype=np.float64, count=num_points
+        )
+
+        # Simulate speed (10-35 km/h)
+        speeds = rng.uniform(15, 30, num_points)
+
+        # Simulate HR and power
+        hrs = np.where(rng.random(num_points) > 0.1, rng.integers(120, 181, num_points), 0).tolist()
+        powers = np.where(rng.random(num_points) > 0.3, rng.integers(150, 251, num_points), 0).tolist()
+
+        # Calculate gradient against the previous (rounded) elevation
+        gradients = np.zeros(num_points)
+        ele_diffs = elevations[1:] - np.round(elevations[:-1], 1)
+        dist_diffs = dist_deltas * 1000  # km to m
+        np.divide(ele_diffs * 100, dist_diffs, out=gradients[1:], where=dist_diffs > 0)
+
+        route_points = [
+            {
+                "lat": lat,
+                "lon": lon,
+                "ele": round(ele, 1),
                 "time": (ride_date + timedelta(seconds=j)).isoformat(),
-                "hr": hr,
-                "power": power,
+                "hr": hr or None,
+                "power": power or None,
                 "speed": round(speed, 1),
-                "distance": round(distance, 2),
+                "distance": round(dist, 2),
                 "gradient": round(gradient, 1)
             }
-            route_points.append(point)
+            for j, (lat, lon, ele, hr, power, speed, dist, gradient) in enumerate(zip(
+                lats.tolist(), lons.tolist(), elevations.tolist(), hrs, powers,
+                speeds.tolist(), distances.tolist(), gradients.tolist()
+            ))
+        ]
 
         # Calculate summary
-        elevation_gain = sum(
-            max(0, route_points[i]["ele"] - route_points[i-1]["ele"])
-            for i in range(1, len(route_points))
-        )
-
-        speeds = [p["speed"] for p in route_points if p["speed"] > 0]
-        avg_speed = sum(speeds) / len(speeds) if speeds else 0
-
-        hrs = [p["hr"] for p in route_points if p["hr"]]
-        avg_hr = sum(hrs) / len(hrs) if hrs else None
-
-        powers = [p["power"] for p in route_points if p["power"]]
-        avg_power = sum(powers) / len(powers) if powers else None
-
-        max_elevation = max(p["ele"] for p in route_points)
+        elevation_gain, avg_speed, avg_hr, avg_power, max_elevation = route_stats(route_points)
 
         ride = {
             "id": f"ride_{ride_date.strftime('%Y%m%d')}",
@@ -8,18 +8,47 @@ Outputs JSON file for React app consumption.
 import os
 import json
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from math import degrees, cos, radians
 from pathlib import Path
 import sys
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(__file__))
 
 from parse_fit import generate_mock_rides, parse_fit_file
-from extract_exif import process_photo_batch
-from match_photos import match_photos_to_ride
+from extract_exif import list_photo_paths, extract_photos
+from match_photos import interpolate_metrics, nearest_route_points, prepare_route
+
 
+def padded_bbox(route_arrays, margin_m):
+    """
+    Bounding box of a route's GPS points, padded by margin_m meters on every side.
 
-def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
+    Returns:
+        (min_lat, max_lat, min_lon, max_lon) in degrees, or None if no point has GPS
+    """
+    if not route_arrays['index'].size:
+        return None
+    lats = np.degrees(route_arrays['lat'])
+    lons = np.degrees(route_arrays['lon'])
+
+    # One degree of longitude shrinks with latitude, so pad for the widest one
+    lat_margin = degrees(margin_m / 6371000)
+    max_abs_lat = min(float(np.abs(lats).max()) + lat_margin, 89.9)
+    lon_margin = lat_margin / cos(radians(max_abs_lat))
+
+    return (lats.min() - lat_margin, lats.max() + lat_margin,
+            lons.min() - lon_margin, lons.max() + lon_margin)
+
+
+def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None, pretty=False):
     """
     Process all rides and generate output JSON.
 
@@ -27,6 +56,7 @@ def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
         use_mock: If True, generate mock rides. If False, parse real FIT files.
         photo_dirs: List of directories containing photos
         fit_dir: Directory containing FIT files
+        pretty: If True, indent the output JSON for reading
     """
     if use_mock:
         print("Generating mock ride data...")
@@ -39,12 +69,16 @@ def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
 
         rides = []
         # Scan for FIT files
-        fit_files = sorted([f for f in os.listdir(fit_dir) if f.endswith('.fit')])
+        with os.scandir(fit_dir) as entries:
+            fit_files = sorted(entry.name for entry in entries if entry.name.endswith('.fit') and entry.is_file())
         print(f"Found {len(fit_files)} FIT files in {fit_dir}")
 
-        for i, file in enumerate(fit_files):
-            print(f"Parsing {file}...")
-            ride_data = parse_fit_file(os.path.join(fit_dir, file))
+        # Each file decodes independently, so spread them across cores
+        with ProcessPoolExecutor() as executor:
+            parsed = list(executor.map(parse_fit_file, [os.path.join(fit_dir, f) for f in fit_files]))
+
+        for i, (file, ride_data) in enumerate(zip(fit_files, parsed)):
+            print(f"Parsed {file}")
             if ride_data and ride_data.get('route'):
                 # Extract date from filename (format: YYYY-MM-DDTHH-MM-SSZ-ID.fit)
                 date_str = file.split('T')[0]
@@ -60,7 +94,7 @@ def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
                 print(f"  Skipped (no route data)")
 
         # Sort rides by start time
-        rides.sort(key=lambda r: r['route'][0]['time'] if r.get('route') and len(r['route']) > 0 else '9999-12-31')
+        rides.sort(key=lambda r: r['route'][0]['time'])
 
         # Renumber rides after sorting
         for i, ride in enumerate(rides):
@@ -72,67 +106,72 @@ def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
             '/Users/clarenceyeung/Downloads/cycling-viz/public/photos'
         ]
 
-    all_photos = []
+    # Gather every directory's photos first so extraction runs as one batch
+    photo_paths = []
     for photo_dir in photo_dirs:
         if os.path.exists(photo_dir):
-            print(f"Processing photos from {photo_dir}...")
-            photos = process_photo_batch(photo_dir)
-            all_photos.extend(photos)
-            print(f"  Found {len(photos)} photos")
-
-    print(f"Total photos: {len(all_photos)}")
+            paths = list_photo_paths(photo_dir)
+            photo_paths.extend(paths)
+            print(f"Found {len(paths)} photos in {photo_dir}")
 
-    # Match photos to rides - use GPS location snapping
-    from math import radians, cos, sin, asin, sqrt
+    print("Processing photos...")
+    all_photos = extract_photos(photo_paths)
+    all_photos.sort(key=lambda x: x['timestamp'] if x['timestamp'] else '')
 
-    def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        """Calculate distance between two GPS coordinates in meters."""
-        R = 6371000  # Earth radius in meters
-        phi1, phi2 = radians(lat1), radians(lat2)
-        dphi = radians(lat2 - lat1)
-        dlambda = radians(lon2 - lon1)
-
-        a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
-        c = 2 * asin(sqrt(a))
+    print(f"Total photos: {len(all_photos)}")
 
-        return R * c
+    # Only GPS-tagged photos can be matched, so filter them out once
+    gps_photos = [photo for photo in all_photos if photo.get('location')]
+    print(f"With GPS: {len(gps_photos)}")
 
     # Initialize empty photo lists for all rides
     for ride in rides:
         ride['photos'] = []
 
-    # For each photo with GPS, find the closest ride route point
-    for photo in all_photos:
-        if not photo.get('location'):
-            continue
-
-        # Find the ride with the closest route point to this photo
-        best_ride = None
-        best_distance = float('inf')
-
-        for ride in rides:
-            if not ride['route']:
-                continue
-
-            # Find closest point in this ride's route
-            for point in ride['route']:
-                if not point.get('lat') or not point.get('lon'):
-                    continue
-
-                distance = haversine_distance(
-                    photo['location']['lat'], photo['location']['lon'],
-                    point['lat'], point['lon']
-                )
-
-                if distance < best_distance:
-                    best_distance = distance
-                    best_ride = ride
-
+    # Match photos to rides - use GPS location snapping.
+    # Each route is converted once to contiguous lat/lon arrays (radians), then
+    # every ride's GPS points are flattened into one set of arrays tagged with
+    # the ride and route index each point came from.
+    route_arrays = [prepare_route(ride['route']) for ride in rides]
+    ride_id_per_point = np.repeat(np.arange(len(rides), dtype=np.intp),
+                                  [arrays['index'].size for arrays in route_arrays])
+    route_index_per_point = np.concatenate(
+        [np.empty(0, dtype=np.intp)] + [arrays['index'] for arrays in route_arrays])
+    all_lats = np.concatenate([np.empty(0)] + [arrays['lat'] for arrays in route_arrays])
+    all_lons = np.concatenate([np.empty(0)] + [arrays['lon'] for arrays in route_arrays])
+
+    # Photos outside every ride's padded bounding box cannot be within the
+    # 1km threshold, so only the rest are searched. All photo/box pairs are
+    # tested at once with broadcasting.
+    bboxes = np.array(
+        [bbox for bbox in (padded_bbox(arrays, 1000) for arrays in route_arrays) if bbox],
+        dtype=np.float64
+    ).reshape(-1, 4)
+    coords = np.array(
+        [(loc['lat'], loc['lon']) for loc in (photo['location'] for photo in gps_photos)],
+        dtype=np.float64
+    ).reshape(-1, 2)
+    photo_lat, photo_lon = coords[:, :1], coords[:, 1:]
+    in_bbox = ((bboxes[:, 0] <= photo_lat) & (photo_lat <= bboxes[:, 1]) &
+               (bboxes[:, 2] <= photo_lon) & (photo_lon <= bboxes[:, 3])).any(axis=1)
+    candidate_photos = [photo for photo, inside in zip(gps_photos, in_bbox) if inside]
+    photo_coords = np.radians(coords[in_bbox])
+
+    # For each photo with GPS, find the closest route point across all rides
+    point_idx, distances = nearest_route_points(all_lats, all_lons, photo_coords[:, 0], photo_coords[:, 1])
+
+    for photo, idx, distance in zip(candidate_photos, point_idx.tolist(), distances.tolist()):
         # Only match photos that are within 1km of any route point
-        if best_ride and best_distance < 1000:  # 1km threshold
-            matched_photos = match_photos_to_ride(best_ride['route'], [photo])
-            if matched_photos:
-                best_ride['photos'].append(matched_photos[0])
+        if distance < 1000:  # 1km threshold
+            # The nearest point is already known, so attach it directly
+            # rather than searching the ride's route again
+            best_ride = rides[ride_id_per_point[idx]]
+            route_index = int(route_index_per_point[idx])
+            best_ride['photos'].append({
+                **photo,
+                'routeIndex': route_index,
+                'stats': interpolate_metrics(best_ride['route'], route_index, photo.get('timestamp', ''))
+            })
 
     # Print results
     for ride in rides:
@@ -145,35 +184,38 @@ def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
         original_count = len(ride['route'])
         original_route = ride['route']
 
-        # Collect indices of points with photos
-        photo_indices = set(photo['routeIndex'] for photo in ride['photos'])
+        # Mark points with photos
+        photo_points = np.zeros(original_count, dtype=bool)
+        photo_points[[photo['routeIndex'] for photo in ride['photos']]] = True
 
         # Keep first, last, every 10th point, AND photo points
-        sampled_route = []
-        old_to_new_index = {}  # Map old indices to new indices
+        keep = photo_points.copy()
+        keep[::10] = True
+        keep[-1:] = True
+        sampled_route = [original_route[i] for i in np.flatnonzero(keep)]
 
-        new_idx = 0
-        for i in range(len(original_route)):
-            if i == 0 or i == len(original_route) - 1 or i % 10 == 0 or i in photo_indices:
-                sampled_route.append(original_route[i])
-                old_to_new_index[i] = new_idx
-                new_idx += 1
+        # Map old indices to new indices: a kept point's new position is the
+        # number of kept points before it
+        old_to_new_index = np.cumsum(keep) - 1
 
         # Update photo routeIndex to point to downsampled route
         for photo in ride['photos']:
-            old_idx = photo['routeIndex']
-            photo['routeIndex'] = old_to_new_index[old_idx]
+            photo['routeIndex'] = int(old_to_new_index[photo['routeIndex']])
 
         ride['route'] = sampled_route
-        print(f"  Downsampled route: {original_count} → {len(sampled_route)} points ({len(photo_indices)} photo points preserved)")
+        print(f"  Downsampled route: {original_count} → {len(sampled_route)} points ({np.count_nonzero(photo_points)} photo points preserved)")
 
     # Write output JSON
     output_data = {'rides': rides}
     output_path = Path(__file__).parent.parent / 'public' / 'data' / 'rides.json'
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, 'w') as f:
-        json.dump(output_data, f, indent=2)
+    if orjson:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if pretty else 0)
+        output_path.write_bytes(orjson.dumps(output_data, option=option))
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(output_data, f, indent=2 if pretty else None)
 
     print(f"\nOutput written to {output_path}")
     print(f"Total rides: {len(rides)}")
@@ -184,25 +226,36 @@ def process_all_rides(use_mock=True, photo_dirs=None, fit_dir=None):
     photos_out_dir = Path(__file__).parent.parent / 'public' / 'photos'
     photos_out_dir.mkdir(parents=True, exist_ok=True)
 
-    copied_count = 0
+    # One directory listing instead of a stat per photo. Sources come from the
+    # paths already listed for EXIF extraction, so the photo directories are
+    # not scanned again; earlier directories win when a filename repeats.
+    with os.scandir(photos_out_dir) as entries:
+        existing = {entry.name for entry in entries}
+    src_map = {}
+    for path in photo_paths:
+        src_map.setdefault(os.path.basename(path), path)
+
+    # A photo matched to several rides only needs copying once
+    filenames = dict.fromkeys(photo['filename'] for ride in rides for photo in ride['photos'])
+
+    # Gather the copies first so they can run concurrently; copy2 releases
+    # the GIL while the disk is busy
+    tasks = []
     skipped_count = 0
-    for ride in rides:
-        for photo in ride['photos']:
-            # Find source photo
-            found = False
-            for photo_dir in photo_dirs:
-                src_path = os.path.join(photo_dir, photo['filename'])
-                if os.path.exists(src_path):
-                    dst_path = photos_out_dir / photo['filename']
-                    if not dst_path.exists():
-                        shutil.copy2(src_path, dst_path)
-                        copied_count += 1
-                    else:
-                        skipped_count += 1
-                    found = True
-                    break
-            if not found:
-                print(f"  WARNING: Photo not found: {photo['filename']}")
+    for filename in filenames:
+        # Find source photo
+        src_path = src_map.get(filename)
+        if src_path is None:
+            print(f"  WARNING: Photo not found: {filename}")
+        elif filename in existing:
+            skipped_count += 1
+        else:
+            tasks.append((src_path, photos_out_dir / filename))
+
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(16, len(tasks))) as executor:
+            list(executor.map(lambda task: shutil.copy2(*task), tasks))
+    copied_count = len(tasks)
 
     if skipped_count > 0:
         print(f"Copied {copied_count} new photos, skipped {skipped_count} existing photos")
@@ -219,13 +272,15 @@ if __name__ == '__main__':
     parser.add_argument('--real', action='store_true', help='Use real FIT files instead of mock data')
     parser.add_argument('--photos', nargs='+', help='Directories containing photos')
     parser.add_argument('--fit-dir', help='Directory containing FIT files')
+    parser.add_argument('--pretty', action='store_true', help='Indent the output JSON')
 
     args = parser.parse_args()
 
     rides = process_all_rides(
         use_mock=not args.real,
         photo_dirs=args.photos,
-        fit_dir=args.fit_dir
+        fit_dir=args.fit_dir,
+        pretty=args.pretty
     )
 
     print("\nDone! Run the React app to visualize the rides.")